@@ -3,17 +3,39 @@ import os
 import discord
 from discord.ext import commands, tasks
 from discord import Intents
-import requests
+import aiohttp
 import json
+import mmap
+import struct
+import zlib
+import copy
+import sqlite3
+import heapq
 import asyncio
 import time
 import random
 from pytz import timezone, UTC, all_timezones
 from flask import Flask
+import threading
 from threading import Thread
+from array import array
+from collections import OrderedDict
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import logging
 import signal
+import sys
+
+# Optional binary snapshot support
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -44,47 +66,658 @@ intents.messages = True
 bot = commands.Bot(command_prefix="!", intents=intents, help_command=None)  # Custom help
 
 # Game data
-players = {}
+players = None  # PlayerStore, opened in on_ready
 bets = {}  # {user_id: {category: {"points": int, "direction": str, "timestamp": float}}}
 current_assets = {}  # {category: asset}
-current_messages = {}  # {category: message}
+current_messages = {}  # {message_id: (guild_id, round_id, category)} for every guild's posts
 last_post_time = None
+current_round_id = None  # YYYYMMDD of the open round
 POST_COOLDOWN_MINUTES = 5
+BET_HISTORY_SIZE = 5  # Recent bets kept per player; full history lives in the archive
+CATEGORIES = ["crypto", "stock", "forex"]
+DIRECTIONS = ["down", "up"]
 
 # Persistent files
 PLAYERS_FILE = "players.json"
+PLAYERS_JOURNAL_FILE = "players.journal"
+PLAYERS_DB_FILE = "players.db"
 CONFIG_FILE = "config.json"
+ARCHIVE_DIR = "archive"
+ROUND_FILE = "round.json"
+ROUND_JOURNAL_FILE = "round.journal"
+round_journal = None
+game_loop_task = None
+POST_CONCURRENCY = int(os.getenv("POST_CONCURRENCY", 25))  # Guilds posted to in parallel
+SUBSCRIBER_DMS = os.getenv("SUBSCRIBER_DMS", "digest").lower()  # "digest" for one DM per user per round event, "each" per guild and category
+SETTLEMENT_PREFETCH_SECONDS = float(os.getenv("SETTLEMENT_PREFETCH_SECONDS", 30))  # Warm prices this long before results
+settlement_task = None
+settlement_lock = asyncio.Lock()
+pinned_prices = None  # (round_id, prices, stale, void, pinned_at)
+
+# Player store settings
+PLAYER_STORE = os.getenv("PLAYER_STORE", "json").lower()  # "json" for small installs, "sqlite" for large ones
+JOURNAL_COMPACT_EVERY = int(os.getenv("JOURNAL_COMPACT_EVERY", 5000))  # Records before snapshot
+PLAYER_FLUSH_MS = int(os.getenv("PLAYER_FLUSH_MS", 500))  # Durability window for dirty players
+PLAYER_FLUSH_BATCH = int(os.getenv("PLAYER_FLUSH_BATCH", 500))  # Flush early once this many are dirty
+PLAYER_CACHE_SIZE = int(os.getenv("PLAYER_CACHE_SIZE", 10000))  # Resident players before LRU eviction
+player_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="player-writer")
+SNAPSHOT_FORMAT = os.getenv("SNAPSHOT_FORMAT", "json").lower()  # "json" or "msgpack"
+SNAPSHOT_COMPRESSION = os.getenv("SNAPSHOT_COMPRESSION", "none").lower()  # "none" or "zstd"
+
+if SNAPSHOT_FORMAT == "msgpack" and not msgpack:
+    logger.warning("msgpack not installed; player snapshots will use JSON")
+    SNAPSHOT_FORMAT = "json"
+if SNAPSHOT_COMPRESSION == "zstd" and not zstandard:
+    logger.warning("zstandard not installed; player snapshots will be uncompressed")
+    SNAPSHOT_COMPRESSION = "none"
+
+SNAPSHOT_MAGIC = b"MMSNAP1"
+BINARY_SNAPSHOT_MAGIC = b"MMSNAP2"
+
+# Write a file via temp file + fsync + rename so readers never see a partial write
+def atomic_write(path: str, data: bytes) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    if os.path.exists(path):
+        os.replace(path, f"{path}.bak")
+    os.replace(tmp_path, path)
+    try:
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass  # Directory fsync is not available on every platform
+
+# Snapshot = "MMSNAP1 <crc32> <length>" header line + JSON body, or
+# "MMSNAP2 <format> <compression> <crc32> <length>" header line + binary body
+def write_snapshot(path: str, obj, fmt: str = "json", compression: str = "none") -> None:
+    if fmt == "json":
+        body = json.dumps(obj).encode()
+        header = SNAPSHOT_MAGIC + f" {zlib.crc32(body):08x} {len(body)}\n".encode()
+    else:
+        body = msgpack.packb(obj)
+        if compression == "zstd":
+            body = zstandard.ZstdCompressor(level=3).compress(body)
+        header = BINARY_SNAPSHOT_MAGIC + f" {fmt} {compression} {zlib.crc32(body):08x} {len(body)}\n".encode()
+    atomic_write(path, header + body)
+
+# Read a snapshot in any format, verifying its checksum; plain JSON files from older versions are accepted
+def read_snapshot(path: str):
+    with open(path, "rb") as f:
+        raw = f.read()
+    if not raw.startswith((SNAPSHOT_MAGIC, BINARY_SNAPSHOT_MAGIC)):
+        return json.loads(raw)
+    header, _, body = raw.partition(b"\n")
+    fields = header.split()
+    crc, length = fields[-2:]
+    if len(body) != int(length) or zlib.crc32(body) != int(crc, 16):
+        raise ValueError(f"{path} failed checksum")
+    if fields[0] == SNAPSHOT_MAGIC:
+        return json.loads(body)
+    fmt, compression = fields[1].decode(), fields[2].decode()
+    if fmt != "msgpack" or not msgpack or (compression == "zstd" and not zstandard):
+        raise ValueError(f"{path} is a {fmt}/{compression} snapshot but support is not installed")
+    if compression == "zstd":
+        body = zstandard.ZstdDecompressor().decompress(body)
+    return msgpack.unpackb(body)
+
+# Read a snapshot, falling back to the previous one if it is missing or corrupt
+def recover_snapshot(path: str, default):
+    for candidate in (path, f"{path}.bak"):
+        try:
+            return read_snapshot(candidate)
+        except FileNotFoundError:
+            continue
+        except ValueError as e:  # Includes JSONDecodeError
+            logger.error(f"Corrupt snapshot {candidate}: {e}")
+    return default
 
 # Load players
 def load_players() -> dict:
-    try:
-        with open(PLAYERS_FILE, "r") as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {}
+    return recover_snapshot(PLAYERS_FILE, {})
 
 # Save players
-def save_players(players: dict) -> None:
+def save_players(players: dict) -> bool:
     try:
-        with open(PLAYERS_FILE, "w") as f:
-            json.dump(players, f)
+        write_snapshot(PLAYERS_FILE, players, SNAPSHOT_FORMAT, SNAPSHOT_COMPRESSION)
         logger.info("Players saved")
+        return True
     except Exception as e:
         logger.error(f"Error saving players: {e}")
+        return False
+
+# Journal record = "<crc32> <json>" so bit rot and torn tails are detected on replay
+def encode_journal_record(user_id: str, data: dict) -> bytes:
+    body = json.dumps({"id": user_id, "data": data}).encode()
+    return f"{zlib.crc32(body):08x} ".encode() + body + b"\n"
+
+def decode_journal_record(line: bytes) -> dict:
+    if not line.endswith(b"\n"):
+        raise ValueError("torn record")
+    if line.startswith(b"{"):
+        return json.loads(line)  # Unchecksummed record from older versions
+    crc, _, body = line.rstrip(b"\n").partition(b" ")
+    if zlib.crc32(body) != int(crc, 16):
+        raise ValueError("checksum mismatch")
+    return json.loads(body)
+
+# Subscription bitmask over CATEGORIES
+def subscription_mask(categories: list[str]) -> int:
+    return sum(1 << CATEGORIES.index(category) for category in set(categories) if category in CATEGORIES)
+
+# Player record; the only place the stored layout is built or read
+class Player:
+    __slots__ = ("name", "points", "last_daily", "subscriptions", "bet_history",
+                 "total", "wins", "category_wins", "streak", "best_streak")
+
+    def __init__(self, name: str, points: int = 100, last_daily: float = 0, subscriptions: int = 0):
+        self.name = name
+        self.points = points
+        self.last_daily = last_daily
+        self.subscriptions = subscriptions  # Bitmask, see subscription_mask
+        self.bet_history = []  # (category, direction, correct), newest last
+        self.total = 0
+        self.wins = 0
+        self.category_wins = [0] * len(CATEGORIES)
+        self.streak = 0
+        self.best_streak = 0
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Player":
+        player = cls(data["name"], data["points"], data.get("last_daily", 0), subscription_mask(data.get("subscriptions", [])))
+        history = [(bet["category"], bet["direction"], bet["correct"]) for bet in data.get("bet_history", [])]
+        stats = data.get("stats")
+        if stats is None:
+            # Records saved before stats existed: rebuild once from the full history
+            for category, _, correct in history:
+                player.update_stats(category, correct)
+        else:
+            player.total = stats["total"]
+            player.wins = stats["wins"]
+            player.category_wins = [stats["category_wins"].get(category, 0) for category in CATEGORIES]
+            player.streak = stats["streak"]
+            player.best_streak = stats["best_streak"]
+        player.bet_history = history[-BET_HISTORY_SIZE:]
+        return player
+
+    def to_dict(self) -> dict:
+        return {
+            "points": self.points,
+            "name": self.name,
+            "bet_history": [{"category": c, "direction": d, "correct": ok} for c, d, ok in self.bet_history],
+            "last_daily": self.last_daily,
+            "subscriptions": self.subscription_list(),
+            "stats": {
+                "total": self.total,
+                "wins": self.wins,
+                "category_wins": {c: n for c, n in zip(CATEGORIES, self.category_wins) if n},
+                "streak": self.streak,
+                "best_streak": self.best_streak,
+            },
+        }
+
+    def copy(self) -> "Player":
+        clone = copy.copy(self)
+        clone.bet_history = list(self.bet_history)
+        clone.category_wins = list(self.category_wins)
+        return clone
+
+    def subscribed(self, category: str) -> bool:
+        return bool(self.subscriptions & subscription_mask([category]))
+
+    def subscribe(self, category: str) -> bool:
+        if self.subscribed(category):
+            return False
+        self.subscriptions |= subscription_mask([category])
+        return True
+
+    def unsubscribe(self, category: str) -> bool:
+        if not self.subscribed(category):
+            return False
+        self.subscriptions &= ~subscription_mask([category])
+        return True
+
+    def subscription_list(self) -> list[str]:
+        return [category for i, category in enumerate(CATEGORIES) if self.subscriptions & (1 << i)]
+
+    def update_stats(self, category: str, correct: bool) -> None:
+        self.total += 1
+        if correct:
+            self.wins += 1
+            self.category_wins[CATEGORIES.index(category)] += 1
+            self.streak += 1
+            self.best_streak = max(self.best_streak, self.streak)
+        else:
+            self.streak = 0
+
+    # Record a settled bet: bounded recent history plus O(1) counters
+    def record_bet(self, category: str, direction: str, correct: bool) -> None:
+        self.update_stats(category, correct)
+        self.bet_history.append((category, direction, correct))
+        if len(self.bet_history) > BET_HISTORY_SIZE:
+            del self.bet_history[:-BET_HISTORY_SIZE]
+
+# Player repository interface
+class PlayerRepository:
+    def get(self, user_id: str) -> Player | None:
+        raise NotImplementedError
+
+    def put_many(self, batch: dict[str, Player]) -> None:
+        raise NotImplementedError
+
+    def put(self, user_id: str, player: Player) -> None:
+        self.put_many({user_id: player})
+
+    def top(self, limit: int) -> list[tuple[str, Player]]:
+        raise NotImplementedError
+
+    def subscribers(self, category: str) -> list[str]:
+        raise NotImplementedError
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+# JSON snapshot + append-only journal
+class JsonPlayerRepository(PlayerRepository):
+    def __init__(self, journal_file: str = PLAYERS_JOURNAL_FILE):
+        self.journal_path = journal_file
+        self.lock = threading.Lock()
+        self.compact_lock = threading.Lock()  # One compaction at a time; readers only wait on self.lock
+        self.journal = None
+        self.journal_records = 0
+        self.players = {user_id: Player.from_dict(data) for user_id, data in load_players().items()}
+        replayed = self.replay_journal()
+        if replayed:
+            logger.info(f"Replayed {replayed} journal records")
+            self.compact()
+
+    # Replay journal on top of snapshot, cutting off any torn or corrupt tail
+    def replay_journal(self) -> int:
+        count = 0
+        good_offset = 0
+        try:
+            with open(self.journal_path, "rb") as f:
+                for line in f:
+                    try:
+                        record = decode_journal_record(line)
+                    except ValueError as e:
+                        logger.warning(f"Bad journal record at byte {good_offset} ({e}), discarding tail")
+                        break
+                    self.players[record["id"]] = Player.from_dict(record["data"])
+                    good_offset += len(line)
+                    count += 1
+            if good_offset < os.path.getsize(self.journal_path):
+                os.truncate(self.journal_path, good_offset)
+        except FileNotFoundError:
+            pass
+        self.journal_records = count
+        return count
+
+    # A copy, since compaction serializes self.players on the writer thread
+    def get(self, user_id: str) -> Player | None:
+        player = self.players.get(user_id)
+        return player.copy() if player is not None else None
+
+    # Append player records to the journal in one write
+    def put_many(self, batch: dict[str, Player]) -> None:
+        with self.lock:
+            self.players.update(batch)
+            try:
+                if self.journal is None:
+                    self.journal = open(self.journal_path, "ab")
+                self.journal.write(b"".join(encode_journal_record(user_id, player.to_dict()) for user_id, player in batch.items()))
+                self.journal.flush()
+                self.journal_records += len(batch)
+            except Exception as e:
+                logger.error(f"Error journaling {len(batch)} players: {e}")
+            compact = self.journal_records >= JOURNAL_COMPACT_EVERY
+        if compact:
+            self.compact()
+
+    def top(self, limit: int) -> list[tuple[str, Player]]:
+        with self.lock:
+            return heapq.nlargest(limit, self.players.items(), key=lambda item: item[1].points)
+
+    def subscribers(self, category: str) -> list[str]:
+        mask = subscription_mask([category])
+        with self.lock:
+            return [user_id for user_id, player in self.players.items() if player.subscriptions & mask]
+
+    def count(self) -> int:
+        return len(self.players)
+
+    # Fold journal into a fresh snapshot. The lock covers only the in-memory copy and the journal
+    # swap; serializing and fsyncing the snapshot happen outside it, so top() is never blocked by them
+    def compact(self) -> None:
+        with self.compact_lock:
+            with self.lock:
+                snapshot = {user_id: player.to_dict() for user_id, player in self.players.items()}
+                folded = self.journal_records
+                offset = os.path.getsize(self.journal_path) if os.path.exists(self.journal_path) else 0
+            if not save_players(snapshot):
+                return  # Keep the journal until a snapshot is safely on disk
+            try:
+                with self.lock:
+                    # Records journaled while the snapshot was written are not in it; keep them
+                    tail = b""
+                    if os.path.exists(self.journal_path):
+                        with open(self.journal_path, "rb") as f:
+                            f.seek(offset)
+                            tail = f.read()
+                    if self.journal is not None:
+                        self.journal.close()
+                    atomic_write(self.journal_path, tail)
+                    self.journal = open(self.journal_path, "ab")
+                    self.journal_records -= folded
+                logger.info("Journal compacted")
+            except Exception as e:
+                logger.error(f"Error compacting journal: {e}")
+
+    def close(self) -> None:
+        if self.journal_records:
+            self.compact()
+
+# SQLite (WAL) store with indexed points, name and subscriptions
+class SqlitePlayerRepository(PlayerRepository):
+    COLUMNS = ("points", "name", "subscriptions")
+
+    def __init__(self, path: str = PLAYERS_DB_FILE):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS players (
+                user_id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                points INTEGER NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_players_points ON players (points DESC);
+            CREATE INDEX IF NOT EXISTS idx_players_name ON players (name);
+            CREATE TABLE IF NOT EXISTS subscriptions (
+                category TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                PRIMARY KEY (category, user_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_subscriptions_user ON subscriptions (user_id);
+        """)
+        if self.count() == 0 and (os.path.exists(PLAYERS_FILE) or os.path.exists(PLAYERS_JOURNAL_FILE)):
+            self.import_players(JsonPlayerRepository().players)  # Snapshot plus replayed journal
+
+    # One-off migration from the JSON store
+    def import_players(self, players: dict[str, Player]) -> None:
+        with self.db:
+            for user_id, player in players.items():
+                self.write(user_id, player)
+        if players:
+            logger.info(f"Imported {len(players)} players into {PLAYERS_DB_FILE}")
+
+    def row_to_player(self, row: tuple) -> Player:
+        points, name, data, subscriptions = row
+        player = json.loads(data)
+        player["points"] = points
+        player["name"] = name
+        player["subscriptions"] = subscriptions.split(",") if subscriptions else []
+        return Player.from_dict(player)
+
+    def select(self, where: str, params: tuple) -> list[tuple]:
+        with self.lock:
+            return self.db.execute(
+                "SELECT p.user_id, p.points, p.name, p.data, "
+                "(SELECT group_concat(category) FROM subscriptions s WHERE s.user_id = p.user_id) "
+                f"FROM players p {where}", params
+            ).fetchall()
+
+    def get(self, user_id: str) -> Player | None:
+        rows = self.select("WHERE p.user_id = ?", (user_id,))
+        return self.row_to_player(rows[0][1:]) if rows else None
+
+    def write(self, user_id: str, player: Player) -> None:
+        data = player.to_dict()
+        extra = {k: v for k, v in data.items() if k not in self.COLUMNS}
+        self.db.execute(
+            "INSERT INTO players (user_id, name, points, data) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET name = excluded.name, points = excluded.points, data = excluded.data",
+            (user_id, data["name"], data["points"], json.dumps(extra))
+        )
+        self.db.execute("DELETE FROM subscriptions WHERE user_id = ?", (user_id,))
+        self.db.executemany(
+            "INSERT INTO subscriptions (category, user_id) VALUES (?, ?)",
+            [(category, user_id) for category in data["subscriptions"]]
+        )
+
+    # One transaction per flushed batch
+    def put_many(self, batch: dict[str, Player]) -> None:
+        with self.lock:
+            try:
+                with self.db:
+                    for user_id, player in batch.items():
+                        self.write(user_id, player)
+            except Exception as e:
+                logger.error(f"Error saving {len(batch)} players: {e}")
+
+    def top(self, limit: int) -> list[tuple[str, Player]]:
+        rows = self.select("ORDER BY p.points DESC LIMIT ?", (limit,))
+        return [(row[0], self.row_to_player(row[1:])) for row in rows]
+
+    def subscribers(self, category: str) -> list[str]:
+        with self.lock:
+            rows = self.db.execute("SELECT user_id FROM subscriptions WHERE category = ?", (category,)).fetchall()
+        return [row[0] for row in rows]
+
+    def count(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM players").fetchone()[0]
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
+
+# Open the configured repository
+def open_player_repository() -> PlayerRepository:
+    if PLAYER_STORE == "sqlite":
+        return SqlitePlayerRepository()
+    if PLAYER_STORE != "json":
+        logger.warning(f"Unknown PLAYER_STORE {PLAYER_STORE}, using json")
+    return JsonPlayerRepository()
+
+# LRU identity map over the repository so handlers can mutate records in place;
+# resident memory follows active players, not registered ones
+class PlayerStore:
+    def __init__(self, repo: PlayerRepository, cache_size: int = PLAYER_CACHE_SIZE):
+        self.repo = repo
+        self.cache_size = cache_size
+        self.records = OrderedDict()
+        self.dirty = {}
+        self.flushing = {}  # Batch handed to the executor but not yet committed
+        self.batch_full = None  # Set once the writer task is running
+        self.writer_task = None
+        # Inverted index category -> subscriber ids, built once and kept current by subscribe/unsubscribe
+        self.subscriber_index = {category: set(repo.subscribers(category)) for category in CATEGORIES}
+
+    def get(self, user_id: str, default=None):
+        data = self.records.get(user_id)
+        if data is not None:
+            self.records.move_to_end(user_id)
+            return data
+        # Evicted records may still be waiting for write-back; the flushing batch belongs to the
+        # executor, so handlers get their own copy of it
+        data = self.dirty.get(user_id)
+        if data is None and user_id in self.flushing:
+            data = self.flushing[user_id].copy()
+        if data is None:
+            data = self.repo.get(user_id)
+        if data is None:
+            return default
+        self.__setitem__(user_id, data)
+        return data
+
+    def __contains__(self, user_id: str) -> bool:
+        return self.get(user_id) is not None
+
+    def __getitem__(self, user_id: str) -> Player:
+        data = self.get(user_id)
+        if data is None:
+            raise KeyError(user_id)
+        return data
+
+    def __setitem__(self, user_id: str, data: Player) -> None:
+        self.records[user_id] = data
+        self.records.move_to_end(user_id)
+        while len(self.records) > self.cache_size:
+            # Dirty records stay referenced by self.dirty, so eviction never drops a write
+            self.records.popitem(last=False)
+
+    # Mark a player dirty; the writer task persists it within the durability window
+    def save(self, user_id: str) -> None:
+        self.dirty[user_id] = self.get(user_id)
+        if self.batch_full is None:
+            self.flush()
+        elif len(self.dirty) >= PLAYER_FLUSH_BATCH:
+            self.batch_full.set()
+
+    # Wake the writer now instead of at the end of the window
+    def flush_soon(self) -> None:
+        if self.batch_full is None:
+            self.flush()
+        else:
+            self.batch_full.set()
+
+    # The single factory for new players
+    def get_or_create(self, user_id: str, name: str) -> Player:
+        player = self.get(user_id)
+        if player is None:
+            player = Player(name)
+            self[user_id] = player
+        return player
+
+    # Copy dirty records so the executor never sees a half-mutated player
+    def take_dirty(self) -> dict[str, Player]:
+        batch = {user_id: player.copy() for user_id, player in self.dirty.items()}
+        self.dirty = {}
+        return batch
+
+    def flush(self) -> None:
+        if self.dirty:
+            self.repo.put_many(self.take_dirty())
+
+    # Background writer: one batched write per window instead of one per mutation
+    async def writer(self) -> None:
+        self.batch_full = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await asyncio.wait_for(self.batch_full.wait(), timeout=PLAYER_FLUSH_MS / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self.batch_full.clear()
+            if self.dirty:
+                self.flushing = self.take_dirty()
+                try:
+                    await loop.run_in_executor(player_executor, self.repo.put_many, self.flushing)
+                    logger.debug(f"Flushed {len(self.flushing)} players")
+                finally:
+                    self.flushing = {}
+
+    def top(self, limit: int) -> list[tuple[str, Player]]:
+        return self.repo.top(limit)
+
+    # Read-only view; copy before awaiting while iterating
+    def subscribers(self, category: str) -> set[str]:
+        return self.subscriber_index[category]
+
+    def subscribe(self, user_id: str, name: str, category: str) -> bool:
+        if not self.get_or_create(user_id, name).subscribe(category):
+            return False
+        self.subscriber_index[category].add(user_id)
+        self.save(user_id)
+        return True
+
+    def unsubscribe(self, user_id: str, category: str) -> bool:
+        player = self.get(user_id)
+        if player is None or not player.unsubscribe(category):
+            return False
+        self.subscriber_index[category].discard(user_id)
+        self.save(user_id)
+        return True
+
+    def close(self) -> None:
+        self.flush()
+        self.repo.close()
+
+    # Stop the writer, let the batch it handed to the executor land, then flush the rest and close
+    # on the same single-thread executor so no older batch can overwrite a newer one
+    async def shutdown(self) -> None:
+        if self.writer_task is not None:
+            self.writer_task.cancel()
+            try:
+                await self.writer_task
+            except asyncio.CancelledError:
+                pass
+        await asyncio.get_running_loop().run_in_executor(player_executor, self.close)
+
+# Settled bet archive: one append-only segment of fixed-width records per round day
+# user id, category, direction, stake, payout, round id
+ARCHIVE_RECORD = struct.Struct("<QBBiiI")
+
+def archive_path(round_id: int) -> str:
+    return os.path.join(ARCHIVE_DIR, f"bets-{round_id}.seg")
+
+def archive_bets(round_id: int, settled: list[tuple]) -> None:
+    try:
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        with open(archive_path(round_id), "ab") as f:
+            f.write(b"".join(
+                ARCHIVE_RECORD.pack(int(user_id), CATEGORIES.index(category), DIRECTIONS.index(direction), stake, payout, round_id)
+                for user_id, category, direction, stake, payout in settled
+            ))
+            f.flush()
+            os.fsync(f.fileno())
+        logger.info(f"Archived {len(settled)} bets for round {round_id}")
+    except Exception as e:
+        logger.error(f"Error archiving bets for round {round_id}: {e}")
+
+# Memory-map one segment and yield its records without loading it into RAM
+def read_archive(round_id: int):
+    try:
+        with open(archive_path(round_id), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                usable = len(mm) - len(mm) % ARCHIVE_RECORD.size  # Ignore a torn trailing record
+                for offset in range(0, usable, ARCHIVE_RECORD.size):
+                    user_id, category, direction, stake, payout, rid = ARCHIVE_RECORD.unpack_from(mm, offset)
+                    yield {"user_id": str(user_id), "category": CATEGORIES[category], "direction": DIRECTIONS[direction],
+                           "stake": stake, "payout": payout, "round_id": rid}
+    except FileNotFoundError:
+        return
+
+# Archived bets for one user over the last N days
+def archived_bets(user_id: str, days: int) -> list[dict]:
+    today = datetime.now(UTC).date()
+    found = []
+    for offset in range(days):
+        round_id = int((today - timedelta(days=offset)).strftime("%Y%m%d"))
+        found.extend(bet for bet in read_archive(round_id) if bet["user_id"] == user_id)
+    return found
 
 # Load config
 def load_config() -> dict:
-    try:
-        with open(CONFIG_FILE, "r") as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {"CHANNEL_ID": {}, "ALERT_CHANNEL_ID": {}, "SERVER_TIMEZONES": {}}
+    return recover_snapshot(CONFIG_FILE, {"CHANNEL_ID": {}, "ALERT_CHANNEL_ID": {}, "SERVER_TIMEZONES": {}})
 
 # Save config
 def save_config(config: dict) -> None:
     try:
-        with open(CONFIG_FILE, "w") as f:
-            json.dump(config, f)
+        write_snapshot(CONFIG_FILE, config)
         logger.info("Config saved")
     except Exception as e:
         logger.error(f"Error saving config: {e}")
@@ -96,89 +729,795 @@ def get_default_channel(guild: discord.Guild) -> discord.TextChannel | None:
             return channel
     return None
 
-# Fetch real stock
-def get_random_stock() -> dict:
-    stocks = ["AAPL", "GOOGL", "MSFT", "AMZN", "TSLA", "NVDA", "META", "JPM", "V", "WMT"]
-    symbol = random.choice(stocks)
-    if ALPHA_VANTAGE_KEY:
-        try:
-            url = f"https://www.alphavantage.co/query?function=GLOBAL_QUOTE&symbol={symbol}&apikey={ALPHA_VANTAGE_KEY}"
-            response = requests.get(url, timeout=10)
+# Market data HTTP settings
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 10))  # Seconds per request
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 50))  # Keep-alive connections overall
+HTTP_POOL_PER_HOST = int(os.getenv("HTTP_POOL_PER_HOST", 8))  # Keep-alive connections per provider
+
+# Shared keep-alive session for every market data request, so fetches never block the gateway
+class MarketDataClient:
+    def __init__(self):
+        self.session = None
+
+    def get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, limit_per_host=HTTP_POOL_PER_HOST, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT),
+            )
+        return self.session
+
+    async def get_json(self, url: str, params: dict | None = None):
+        async with self.get_session().get(url, params=params) as response:
             response.raise_for_status()
-            data = response.json()['Global Quote']
-            price = float(data['05. price'])
-            return {"name": symbol, "symbol": symbol, "current_price": price}
+            return await response.json(content_type=None)
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+
+market_client = MarketDataClient()
+
+# Provider quotas as (requests, per seconds); defaults match the free tiers
+PROVIDER_LIMITS = {
+    "coingecko": (int(os.getenv("COINGECKO_RATE", 10)), 60),
+    "alphavantage": (int(os.getenv("ALPHA_VANTAGE_RATE", 5)), 60),
+    "exchangerate": (int(os.getenv("EXCHANGE_RATE_RATE", 30)), 60),
+}
+PROVIDER_DEADLINE = float(os.getenv("PROVIDER_DEADLINE", 90))  # Seconds a request may queue for quota
+PROVIDER_LATENCY_BUDGET = float(os.getenv("PROVIDER_LATENCY_BUDGET", 8))  # Seconds per request once it has quota
+HEDGE_DELAY = float(os.getenv("HEDGE_DELAY", 2))  # Seconds before a slow or failed attempt is hedged
+MAX_HEDGES = int(os.getenv("MAX_HEDGES", 1))
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", 3))  # Consecutive failures before the circuit opens
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", 60))  # Seconds before a trial request is let through
+
+class ProviderUnavailable(Exception):
+    pass
+
+# Circuit breaker: fail fast while a provider is down, then let one trial request through
+class CircuitBreaker:
+    def __init__(self, name: str):
+        self.name = name
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if time.monotonic() - self.opened_at >= BREAKER_COOLDOWN and not self.trial:
+            self.trial = True  # Half-open
+            return True
+        return False
+
+    def record_success(self) -> None:
+        if self.opened_at is not None:
+            logger.info(f"{self.name} circuit closed")
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    # A half-open trial that never got an answer (no quota, cancelled) frees the slot for the next caller
+    def abandon(self) -> None:
+        self.trial = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.trial or self.failures >= BREAKER_THRESHOLD:
+            if self.opened_at is None or self.trial:
+                logger.warning(f"{self.name} circuit open for {BREAKER_COOLDOWN:.0f}s after {self.failures} failures")
+            self.opened_at = time.monotonic()
+            self.trial = False
+
+# Token bucket; callers queue in FIFO order behind the lock until a token or their deadline
+class TokenBucket:
+    def __init__(self, rate: int, per: float):
+        self.capacity = rate
+        self.tokens = float(rate)
+        self.fill_rate = rate / per
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+        self.updated = now
+        return now
+
+    # Take a token only if one is free right now and nobody is queued ahead
+    def try_acquire(self) -> bool:
+        if self.lock.locked():
+            return False
+        self.refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    # Callers queue FIFO on the lock; the deadline bounds the wait in the queue as well as for the token
+    async def acquire(self, deadline: float) -> None:
+        queue_time = deadline - time.monotonic()
+        if queue_time <= 0:
+            raise TimeoutError("deadline passed while queued")
+        try:
+            await asyncio.wait_for(self.lock.acquire(), timeout=None if queue_time == float("inf") else queue_time)
+        except asyncio.TimeoutError:
+            raise TimeoutError("deadline passed while queued")
+        try:
+            while True:
+                now = self.refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.fill_rate
+                if now + wait > deadline:
+                    raise TimeoutError("quota not available before deadline")
+                await asyncio.sleep(wait)
+        finally:
+            self.lock.release()
+
+# Per-provider scheduler: quota via token bucket, identical in-flight requests share one call,
+# circuit breaker and hedged retries keep each request within its latency budget
+class ProviderScheduler:
+    def __init__(self, name: str, rate: int, per: float):
+        self.name = name
+        self.bucket = TokenBucket(rate, per)
+        self.breaker = CircuitBreaker(name)
+        self.in_flight = {}
+
+    async def fetch(self, url: str, params: dict | None, deadline: float):
+        if not self.breaker.allow():
+            raise ProviderUnavailable(f"{self.name} circuit open")
+        try:
+            await self.bucket.acquire(deadline)
+        except BaseException:
+            self.breaker.abandon()
+            raise
+        try:
+            result = await self.hedged(url, params, time.monotonic() + PROVIDER_LATENCY_BUDGET)
+        except asyncio.CancelledError:
+            self.breaker.abandon()
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return result
+
+    # First successful attempt wins; a hedge fires when an attempt is slow or fails, quota permitting.
+    # Finished attempts are always collected before the budget is checked
+    async def hedged(self, url: str, params: dict | None, budget_end: float):
+        attempts = {asyncio.ensure_future(market_client.get_json(url, params))}
+        hedges = 0
+        last_error = None
+        try:
+            while True:
+                remaining = max(0, budget_end - time.monotonic())
+                done, attempts = await asyncio.wait(attempts, timeout=min(HEDGE_DELAY, remaining), return_when=asyncio.FIRST_COMPLETED)
+                for attempt in done:
+                    if attempt.exception() is None:
+                        return attempt.result()
+                    last_error = attempt.exception()
+                if time.monotonic() >= budget_end:
+                    raise TimeoutError(f"{self.name} latency budget exhausted")
+                if hedges < MAX_HEDGES:
+                    # While an attempt is still running, never block on quota; hedge only on a free token
+                    if attempts:
+                        acquired = self.bucket.try_acquire()
+                    else:
+                        try:
+                            await self.bucket.acquire(budget_end)
+                            acquired = True
+                        except TimeoutError:
+                            acquired = False
+                    if acquired:
+                        attempts.add(asyncio.ensure_future(market_client.get_json(url, params)))
+                        hedges += 1
+                if not attempts:
+                    raise last_error
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+
+    async def get_json(self, url: str, params: dict | None = None, deadline: float | None = None):
+        key = (url, tuple(sorted((params or {}).items())))
+        future = self.in_flight.get(key)
+        if future is None:
+            deadline = deadline or time.monotonic() + PROVIDER_DEADLINE
+            future = asyncio.ensure_future(self.fetch(url, params, deadline))
+            self.in_flight[key] = future
+            future.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        # Shield so one cancelled caller does not cancel the shared request
+        return await asyncio.shield(future)
+
+providers = {name: ProviderScheduler(name, rate, per) for name, (rate, per) in PROVIDER_LIMITS.items()}
+
+# Asset universes
+STOCK_UNIVERSE = [
+    "AAPL", "GOOGL", "MSFT", "AMZN", "TSLA", "NVDA", "META", "JPM", "V", "WMT",
+    "AVGO", "BRK.B", "LLY", "UNH", "XOM", "MA", "JNJ", "PG", "HD", "COST",
+    "ORCL", "ABBV", "MRK", "CVX", "BAC", "KO", "PEP", "ADBE", "CRM", "NFLX",
+    "AMD", "TMO", "ACN", "MCD", "CSCO", "ABT", "LIN", "WFC", "DIS", "INTU",
+    "DHR", "TXN", "VZ", "QCOM", "PM", "CAT", "IBM", "AMGN", "GE", "NOW",
+    "UNP", "PFE", "CMCSA", "NEE", "SPGI", "HON", "LOW", "GS", "INTC", "RTX",
+    "UBER", "T", "BKNG", "AMAT", "ISRG", "PGR", "ELV", "MS", "BLK", "SYK",
+    "TJX", "C", "LMT", "VRTX", "SCHW", "MDT", "PLD", "ADP", "BA", "REGN",
+    "DE", "CB", "MMC", "SBUX", "ADI", "GILD", "MU", "PANW", "BMY", "LRCX",
+    "SO", "MDLZ", "CI", "TMUS", "PYPL", "SHOP", "ABNB", "SNOW", "PLTR", "COIN",
+]
+FOREX_CURRENCIES = ["EUR", "GBP", "AUD", "NZD", "USD", "CAD", "CHF", "JPY"]  # Market quoting priority
+FOREX_UNIVERSE = [base + quote for i, base in enumerate(FOREX_CURRENCIES) for quote in FOREX_CURRENCIES[i + 1:]]  # 28 majors and crosses
+FOREX_PIVOT = "USD"  # Every pair is derived from this base's conversion table
+FOREX_TABLE_TTL = float(os.getenv("FOREX_TABLE_TTL", 300))  # Seconds a conversion table is reused
+CRYPTO_UNIVERSE = [  # (Coingecko id, name, symbol)
+    ("bitcoin", "Bitcoin", "btc"), ("ethereum", "Ethereum", "eth"), ("binancecoin", "BNB", "bnb"),
+    ("solana", "Solana", "sol"), ("ripple", "XRP", "xrp"), ("dogecoin", "Dogecoin", "doge"),
+    ("cardano", "Cardano", "ada"), ("tron", "TRON", "trx"), ("avalanche-2", "Avalanche", "avax"),
+    ("chainlink", "Chainlink", "link"),
+]
+STOCK_BULK_LIMIT = 100  # Symbols per Alpha Vantage bulk quote call
+MARKET_DATA_REPLAY = os.getenv("MARKET_DATA_REPLAY")  # Recorded market data file; no network when set
+MARKET_DATA_RECORD = os.getenv("MARKET_DATA_RECORD")  # Record live market data to this file
+REPLAY_LATENCY_MS = float(os.getenv("REPLAY_LATENCY_MS", 0))  # Simulated latency per replayed call
+REPLAY_SEED = int(os.getenv("REPLAY_SEED", 0))  # Asset picks repeat run to run when replaying
+UNIVERSE_FILE = "universe.json"
+UNIVERSE_REFRESH_HOURS = float(os.getenv("UNIVERSE_REFRESH_HOURS", 24))
+UNIVERSE_SIZE = int(os.getenv("UNIVERSE_SIZE", 100))  # Crypto candidates pulled from Coingecko
+UNIVERSE_MIN_VOLATILITY = float(os.getenv("UNIVERSE_MIN_VOLATILITY", 0.005))  # 24h range below this looks pegged
+DERIVATIVE_TOKEN_WORDS = ("wrapped", "staked", "bridged", "restaked", "liquid", "tokenized")
+
+# Market data provider interface; assets are dicts with at least name and symbol
+class MarketDataProvider:
+    def configured(self) -> bool:
+        return True
+
+    def universe(self) -> list[dict]:
+        raise NotImplementedError
+
+    # {symbol: price} for every asset the provider could price
+    async def batch_quote(self, assets: list[dict]) -> dict:
+        raise NotImplementedError
+
+    async def quote(self, asset: dict) -> float | None:
+        return (await self.batch_quote([asset])).get(asset["symbol"])
+
+    # Candidate assets with metadata (market_cap, last_price, volatility) for the universe service
+    async def refresh_universe(self, previous: list[dict]) -> list[dict]:
+        return self.universe()
+
+# Daily move between two universe refreshes, used as a volatility estimate
+def price_change_metadata(assets: list[dict], prices: dict, previous: list[dict]) -> list[dict]:
+    last_prices = {asset["symbol"]: asset.get("last_price") for asset in previous}
+    refreshed = []
+    for asset in assets:
+        asset = dict(asset)
+        price = prices.get(asset["symbol"])
+        if price is not None:
+            before = last_prices.get(asset["symbol"])
+            asset["last_price"] = price
+            asset["volatility"] = round(abs(price - before) / before, 6) if before else None
+        refreshed.append(asset)
+    return refreshed
+
+# Coingecko: one simple/price call for any number of coins
+# A token priced within 1% of a coin at least 5x its size is a wrapper or liquid staking token of it
+def tracks(asset: dict, other: dict) -> bool:
+    if not (asset["last_price"] and other["last_price"] and asset["market_cap"] and other["market_cap"]):
+        return False
+    return abs(asset["last_price"] - other["last_price"]) / other["last_price"] < 0.01 and other["market_cap"] >= 5 * asset["market_cap"]
+
+class CoingeckoProvider(MarketDataProvider):
+    def universe(self) -> list[dict]:
+        return [{"id": coin_id, "name": name, "symbol": symbol} for coin_id, name, symbol in CRYPTO_UNIVERSE]
+
+    # Top coins by market cap; volatility is the 24h range relative to price
+    async def refresh_universe(self, previous: list[dict]) -> list[dict]:
+        url = "https://api.coingecko.com/api/v3/coins/markets"
+        coins = await providers["coingecko"].get_json(url, {"vs_currency": "usd", "order": "market_cap_desc", "per_page": UNIVERSE_SIZE})
+        assets = [{
+            "id": coin["id"], "name": coin["name"], "symbol": coin["symbol"],
+            "market_cap": coin.get("market_cap"), "last_price": coin.get("current_price"),
+            "volatility": round((coin["high_24h"] - coin["low_24h"]) / coin["current_price"], 6) if coin.get("high_24h") and coin.get("low_24h") and coin.get("current_price") else None,
+        } for coin in coins]
+        return self.tradeable(assets)
+
+    # Drop pegged assets (stablecoins barely move, so up/down is noise) and wrapped, staked or bridged
+    # tokens, which track a larger coin already in the list; input is in market cap order
+    @staticmethod
+    def tradeable(assets: list[dict]) -> list[dict]:
+        kept = []
+        for asset in assets:
+            if asset["volatility"] is not None and asset["volatility"] < UNIVERSE_MIN_VOLATILITY:
+                continue
+            if set(asset["name"].lower().split()) & set(DERIVATIVE_TOKEN_WORDS):
+                continue
+            if any(tracks(asset, other) for other in kept):
+                continue
+            kept.append(asset)
+        return kept
+
+    async def batch_quote(self, assets: list[dict]) -> dict:
+        url = "https://api.coingecko.com/api/v3/simple/price"
+        ids = sorted({asset["id"] for asset in assets})
+        try:
+            data = await providers["coingecko"].get_json(url, {"ids": ",".join(ids), "vs_currencies": "usd"})
+            return {asset["symbol"]: data[asset["id"]]["usd"] for asset in assets if asset["id"] in data}
+        except Exception as e:
+            logger.error(f"Coingecko error: {e}")
+            return {}
+
+# Alpha Vantage: bulk quotes in chunks, per-symbol GLOBAL_QUOTE for anything the bulk call missed
+class AlphaVantageProvider(MarketDataProvider):
+    url = "https://www.alphavantage.co/query"
+
+    def configured(self) -> bool:
+        return bool(ALPHA_VANTAGE_KEY)
+
+    def universe(self) -> list[dict]:
+        return [{"name": symbol, "symbol": symbol} for symbol in STOCK_UNIVERSE]
+
+    async def bulk(self, chunk: list[str]) -> dict:
+        try:
+            data = await providers["alphavantage"].get_json(self.url, {"function": "REALTIME_BULK_QUOTES", "symbol": ",".join(chunk), "apikey": ALPHA_VANTAGE_KEY})
+            return {quote["symbol"]: float(quote["close"]) for quote in data.get("data", [])}
+        except Exception as e:
+            logger.error(f"Alpha Vantage bulk error: {e}")
+            return {}
+
+    async def single(self, symbol: str) -> tuple[str, float | None]:
+        try:
+            data = await providers["alphavantage"].get_json(self.url, {"function": "GLOBAL_QUOTE", "symbol": symbol, "apikey": ALPHA_VANTAGE_KEY})
+            return symbol, float(data["Global Quote"]["05. price"])
         except Exception as e:
             logger.error(f"Alpha Vantage error: {e}")
-    # Fallback mock
-    return {"name": symbol, "symbol": symbol, "current_price": round(random.uniform(100, 1000), 2)}
-
-# Fetch real forex
-def get_random_forex() -> dict:
-    pairs = ["EURUSD", "USDJPY", "GBPUSD", "AUDUSD", "USDCAD", "NZDUSD", "EURJPY"]
-    pair = random.choice(pairs)
-    base, quote = pair[:3], pair[3:]
-    if EXCHANGE_RATE_KEY:
+            return symbol, None
+
+    # Bulk quotes only, so a refresh never spends the per-symbol quota
+    async def refresh_universe(self, previous: list[dict]) -> list[dict]:
+        assets = self.universe()
+        if not self.configured():
+            return assets
+        prices = {}
+        for i in range(0, len(STOCK_UNIVERSE), STOCK_BULK_LIMIT):
+            prices.update(await self.bulk(STOCK_UNIVERSE[i:i + STOCK_BULK_LIMIT]))
+        return price_change_metadata(assets, prices, previous)
+
+    async def batch_quote(self, assets: list[dict]) -> dict:
+        if not self.configured():
+            return {}
+        symbols = sorted({asset["symbol"] for asset in assets})
+        prices = {}
+        chunks = [symbols[i:i + STOCK_BULK_LIMIT] for i in range(0, len(symbols), STOCK_BULK_LIMIT)]
+        for chunk_prices in await asyncio.gather(*(self.bulk(chunk) for chunk in chunks)):
+            prices.update(chunk_prices)
+        missing = [symbol for symbol in symbols if symbol not in prices]
+        for symbol, price in await asyncio.gather(*(self.single(symbol) for symbol in missing)):
+            if price is not None:
+                prices[symbol] = price
+        return prices
+
+# ExchangeRate-API: one cached latest/{pivot} table prices every pair through local cross rates
+class ExchangeRateProvider(MarketDataProvider):
+    def __init__(self):
+        self.tables = {}  # {base: (conversion_rates, fetched_at)}
+
+    def configured(self) -> bool:
+        return bool(EXCHANGE_RATE_KEY)
+
+    def universe(self) -> list[dict]:
+        return [{"name": pair, "symbol": pair} for pair in FOREX_UNIVERSE]
+
+    async def table(self, base: str) -> dict:
+        cached = self.tables.get(base)
+        if cached and time.time() - cached[1] < FOREX_TABLE_TTL:
+            return cached[0]
         try:
             url = f"https://v6.exchangerate-api.com/v6/{EXCHANGE_RATE_KEY}/latest/{base}"
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            rate = data['conversion_rates'][quote]
-            return {"name": pair, "symbol": pair, "current_price": rate}
+            rates = (await providers["exchangerate"].get_json(url))["conversion_rates"]
+            self.tables[base] = (rates, time.time())
+            return rates
         except Exception as e:
             logger.error(f"ExchangeRate-API error: {e}")
-    # Fallback mock
-    return {"name": pair, "symbol": pair, "current_price": round(random.uniform(0.8, 1.5), 4)}
+            return {}
 
-# Fetch real crypto (Coingecko, free)
-def get_random_crypto() -> dict:
-    url = "https://api.coingecko.com/api/v3/coins/markets?vs_currency=usd&order=market_cap_desc&per_page=10"
-    try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        coins = response.json()
-        return random.choice(coins)
-    except Exception as e:
-        logger.error(f"Coingecko error: {e}")
-        return {"name": "BTC", "symbol": "BTC", "current_price": 30000}
-
-# Get daily assets
-def get_daily_assets() -> dict:
-    return {
-        "crypto": get_random_crypto(),
-        "stock": get_random_stock(),
-        "forex": get_random_forex()
-    }
+    # BASEQUOTE from a table keyed off another currency, e.g. EURJPY = USDJPY / USDEUR
+    @staticmethod
+    def cross(rates: dict, table_base: str, pair: str) -> float | None:
+        base, quote = pair[:3], pair[3:]
+        base_rate = 1.0 if base == table_base else rates.get(base)
+        quote_rate = 1.0 if quote == table_base else rates.get(quote)
+        if not base_rate or quote_rate is None:
+            return None
+        return round(quote_rate / base_rate, 6)
+
+    async def refresh_universe(self, previous: list[dict]) -> list[dict]:
+        assets = self.universe()
+        if not self.configured():
+            return assets
+        return price_change_metadata(assets, await self.batch_quote(assets), previous)
+
+    async def batch_quote(self, assets: list[dict]) -> dict:
+        if not self.configured():
+            return {}
+        pairs = sorted({asset["symbol"] for asset in assets})
+        pivot = await self.table(FOREX_PIVOT)
+        prices = {}
+        for pair in pairs:
+            price = self.cross(pivot, FOREX_PIVOT, pair)
+            if price is None:  # Currency missing from the pivot table: use the pair's own base table
+                price = self.cross(await self.table(pair[:3]), pair[:3], pair)
+            if price is not None:
+                prices[pair] = price
+        return prices
+
+# Offline provider serving recorded universes and quotes; each symbol replays its own recorded prices
+# in order (cycling), and only symbols with recorded quotes are offered, so every replayed round is priced
+# File layout: {category: {"universe": [asset, ...], "quotes": [{symbol: price}, ...]}}
+class ReplayProvider(MarketDataProvider):
+    def __init__(self, category: str, path: str, latency_ms: float = REPLAY_LATENCY_MS):
+        recorded = read_snapshot(path).get(category, {})  # Recordings are checksummed snapshots; plain JSON also loads
+        self.series = {}
+        for snapshot in recorded.get("quotes", []):
+            for symbol, price in snapshot.items():
+                self.series.setdefault(symbol, []).append(price)
+        self.assets = [asset for asset in recorded.get("universe", []) if asset["symbol"] in self.series]
+        self.latency = latency_ms / 1000
+        self.served = {}
+
+    def universe(self) -> list[dict]:
+        return self.assets
+
+    async def batch_quote(self, assets: list[dict]) -> dict:
+        await asyncio.sleep(self.latency)
+        prices = {}
+        for asset in assets:
+            series = self.series.get(asset["symbol"])
+            if series:
+                served = self.served.get(asset["symbol"], 0)
+                prices[asset["symbol"]] = series[served % len(series)]
+                self.served[asset["symbol"]] = served + 1
+        return prices
+
+# One replay file shared by every recording provider; kept in memory and written off the event loop,
+# one write at a time, in order
+class MarketDataRecorder:
+    def __init__(self, path: str):
+        self.path = path
+        self.recorded = recover_snapshot(path, {})  # Appends to an existing recording
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def entry(self, category: str, universe: list[dict]) -> dict:
+        return self.recorded.setdefault(category, {"universe": universe, "quotes": []})
+
+    def record_universe(self, category: str, universe: list[dict]) -> None:
+        self.entry(category, universe)["universe"] = universe
+        self.write()
+
+    def record_quotes(self, category: str, universe: list[dict], prices: dict) -> None:
+        self.entry(category, universe)["quotes"].append(prices)
+        self.write()
+
+    # Recorded lists are only appended to or replaced, so copying them is enough for the writer thread
+    def write(self) -> None:
+        state = {category: {"universe": list(entry["universe"]), "quotes": list(entry["quotes"])} for category, entry in self.recorded.items()}
+        asyncio.get_running_loop().run_in_executor(self.executor, write_snapshot, self.path, state)
+
+# Wraps a live provider and records what it returns to a replay file
+class RecordingProvider(MarketDataProvider):
+    def __init__(self, category: str, provider: MarketDataProvider, recorder: MarketDataRecorder):
+        self.category = category
+        self.provider = provider
+        self.recorder = recorder
+
+    def configured(self) -> bool:
+        return self.provider.configured()
+
+    def universe(self) -> list[dict]:
+        return self.provider.universe()
+
+    async def refresh_universe(self, previous: list[dict]) -> list[dict]:
+        assets = await self.provider.refresh_universe(previous)
+        self.recorder.record_universe(self.category, assets)
+        return assets
 
-# Fetch new price for results
-def fetch_new_price(asset: dict, category: str) -> float:
+    async def batch_quote(self, assets: list[dict]) -> dict:
+        prices = await self.provider.batch_quote(assets)
+        self.recorder.record_quotes(self.category, self.universe(), prices)
+        return prices
+
+# Build the provider per category from the environment
+def open_market_providers() -> dict:
+    if MARKET_DATA_REPLAY:
+        logger.info(f"Replaying market data from {MARKET_DATA_REPLAY}")
+        return {category: ReplayProvider(category, MARKET_DATA_REPLAY) for category in CATEGORIES}
+    live = {"crypto": CoingeckoProvider(), "stock": AlphaVantageProvider(), "forex": ExchangeRateProvider()}
+    if MARKET_DATA_RECORD:
+        recorder = MarketDataRecorder(MARKET_DATA_RECORD)
+        return {category: RecordingProvider(category, provider, recorder) for category, provider in live.items()}
+    return live
+
+market_providers = open_market_providers()
+
+# Price any number of (category, asset) pairs with a constant number of requests per provider
+async def fetch_quotes(assets: list[tuple[str, dict]]) -> dict:
+    wanted = {}
+    for category, asset in assets:
+        wanted.setdefault(category, {})[asset["symbol"]] = asset
+    results = await asyncio.gather(*(market_providers[category].batch_quote(list(batch.values())) for category, batch in wanted.items()))
+    by_category = dict(zip(wanted, results))
+    return {(category, asset["symbol"]): by_category[category].get(asset["symbol"]) for category, asset in assets}
+
+# Mock prices when a provider has no key or no answer
+def mock_price(category: str) -> float:
+    if category == "forex":
+        return round(random.uniform(0.8, 1.5), 4)
     if category == "crypto":
-        url = f"https://api.coingecko.com/api/v3/simple/price?ids={asset['id']}&vs_currencies=usd"
-        try:
-            response = requests.get(url, timeout=10)
-            return response.json()[asset['id']]['usd']
-        except Exception:
-            return asset['current_price'] + random.uniform(-50, 50)  # Fallback
-    elif category == "stock":
-        if ALPHA_VANTAGE_KEY:
-            url = f"https://www.alphavantage.co/query?function=GLOBAL_QUOTE&symbol={asset['symbol']}&apikey={ALPHA_VANTAGE_KEY}"
+        return 30000
+    return round(random.uniform(100, 1000), 2)
+
+# Candidate assets per category, refreshed on a schedule and persisted so posting never lists markets;
+# with no path nothing is loaded or written (replays must not touch the live universe file)
+class UniverseService:
+    def __init__(self, path: str | None = UNIVERSE_FILE, rng: random.Random = random):
+        self.path = path
+        self.rng = rng
+        state = recover_snapshot(path, {}) if path else {}
+        self.assets = state.get("assets", {})
+        self.refreshed_at = state.get("refreshed_at", 0)
+
+    def candidates(self, category: str) -> list[dict]:
+        return self.assets.get(category) or market_providers[category].universe()
+
+    def pick(self, category: str) -> dict:
+        return dict(self.rng.choice(self.candidates(category)))
+
+    async def refresh(self) -> None:
+        for category in CATEGORIES:
             try:
-                response = requests.get(url, timeout=10)
-                return float(response.json()['Global Quote']['05. price'])
-            except Exception:
-                pass
-        return asset['current_price'] + random.uniform(-50, 50)
-    elif category == "forex":
-        base, quote = asset['symbol'][:3], asset['symbol'][3:]
-        if EXCHANGE_RATE_KEY:
-            url = f"https://v6.exchangerate-api.com/v6/{EXCHANGE_RATE_KEY}/latest/{base}"
+                refreshed = await market_providers[category].refresh_universe(self.assets.get(category, []))
+                if refreshed:
+                    self.assets[category] = refreshed
+            except Exception as e:
+                logger.error(f"Universe refresh failed for {category}: {e}")
+        self.refreshed_at = time.time()
+        if self.path:
+            state = {"refreshed_at": self.refreshed_at, "assets": self.assets}
+            await asyncio.get_running_loop().run_in_executor(None, write_snapshot, self.path, state)
+        logger.info(f"Universe refreshed: {', '.join(f'{c} {len(self.candidates(c))}' for c in CATEGORIES)}")
+
+    async def run(self) -> None:
+        while True:
+            due_in = self.refreshed_at + UNIVERSE_REFRESH_HOURS * 3600 - time.time()
+            if due_in > 0:
+                await asyncio.sleep(due_in)
+            await self.refresh()
+
+universe_service = UniverseService(None, random.Random(REPLAY_SEED)) if MARKET_DATA_REPLAY else UniverseService()
+
+# Pick a random asset from the category's cached universe
+def pick_asset(category: str) -> dict:
+    return universe_service.pick(category)
+
+# Intraday tick settings
+TICK_INTERVAL = float(os.getenv("TICK_INTERVAL", 1800))  # Seconds between samples of the round's assets
+TICK_CAPACITY = int(os.getenv("TICK_CAPACITY", 256))  # Ticks kept per asset
+
+# Fixed-size ring buffer of (timestamp, price) for one asset
+class TickSeries:
+    __slots__ = ("times", "prices", "next", "count")
+
+    def __init__(self, capacity: int):
+        self.times = array("d", bytes(8 * capacity))
+        self.prices = array("d", bytes(8 * capacity))
+        self.next = 0
+        self.count = 0
+
+    def append(self, at: float, price: float) -> None:
+        self.times[self.next] = at
+        self.prices[self.next] = price
+        self.next = (self.next + 1) % len(self.times)
+        self.count = min(self.count + 1, len(self.times))
+
+    # Oldest first
+    def items(self) -> list[tuple[float, float]]:
+        start = (self.next - self.count) % len(self.times)
+        indexes = [(start + i) % len(self.times) for i in range(self.count)]
+        return [(self.times[i], self.prices[i]) for i in indexes]
+
+# Intraday ticks keyed by (category, symbol); every fetched price is recorded here
+class TickStore:
+    def __init__(self, capacity: int = TICK_CAPACITY):
+        self.capacity = capacity
+        self.series = {}
+
+    def record(self, key: tuple, price: float, at: float) -> None:
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = TickSeries(self.capacity)
+        series.append(at, price)
+
+    def ticks(self, key: tuple, since: float = 0) -> list[tuple[float, float]]:
+        series = self.series.get(key)
+        return [tick for tick in series.items() if tick[0] >= since] if series else []
+
+    # (open, high, low, last) since a timestamp, or None without ticks
+    def summary(self, key: tuple, since: float = 0) -> tuple | None:
+        prices = [price for _, price in self.ticks(key, since)]
+        if not prices:
+            return None
+        return prices[0], max(prices), min(prices), prices[-1]
+
+    # Keep only the given assets, e.g. when a new round starts
+    def retain(self, keys: set) -> None:
+        self.series = {key: series for key, series in self.series.items() if key in keys}
+
+tick_store = TickStore()
+
+# Last-known-good price cache: {(category, symbol): (price, fetched_at)}
+PRICE_CACHE_TTL = int(os.getenv("PRICE_CACHE_TTL", 300))  # Seconds a price counts as fresh
+price_cache = {}
+
+# Fresh cached prices, one batch for the rest, and last-known-good values (flagged stale) when a provider fails
+async def get_prices(assets: dict, max_age: float = PRICE_CACHE_TTL) -> tuple[dict, set]:
+    now = time.time()
+    missing = [(category, asset) for category, asset in assets.items()
+               if not (cached := price_cache.get((category, asset["symbol"]))) or now - cached[1] >= max_age]
+    if missing:
+        for key, price in (await fetch_quotes(missing)).items():
+            if price is not None:
+                price_cache[key] = (price, now)
+                tick_store.record(key, price, now)
+    prices, stale = {}, set()
+    for category, asset in assets.items():
+        cached = price_cache.get((category, asset["symbol"]))
+        if cached:
+            prices[category] = cached[0]
+            if now - cached[1] >= PRICE_CACHE_TTL:
+                stale.add(category)
+    return prices, stale
+
+# Sample the open round's assets so results and disputes can use intraday ticks
+async def sample_ticks() -> None:
+    while True:
+        await asyncio.sleep(TICK_INTERVAL)
+        if current_assets:
             try:
-                response = requests.get(url, timeout=10)
-                return response.json()['conversion_rates'][quote]
-            except Exception:
-                pass
-        return asset['current_price'] + random.uniform(-0.1, 0.1)
+                await get_prices(current_assets, max_age=TICK_INTERVAL / 2)
+            except Exception as e:
+                logger.error(f"Tick sampling error: {e}")
+
+# Categories with no API key run on mock prices by design
+def is_mocked(category: str) -> bool:
+    return not market_providers[category].configured()
+
+# Get daily assets, priced in one batch
+async def get_daily_assets() -> dict:
+    assets = {category: pick_asset(category) for category in CATEGORIES}
+    prices, stale = await get_prices(assets)
+    for category, asset in assets.items():
+        asset["current_price"] = prices.get(category, mock_price(category))
+        # When the posted price was observed; None when it is a stand-in, so settlement can tell
+        asset["priced_at"] = price_cache[(category, asset["symbol"])][1] if category in prices else None
+    if stale:
+        logger.warning(f"Posting stale prices for {', '.join(stale)}")
+    return assets
+
+# Round-level settlement snapshot; returns prices, the categories settled on stale data and the void ones:
+# without a real price observed after the posted one there is no move to settle, only stakes to refund
+async def get_settlement_prices(assets: dict, max_age: float = PRICE_CACHE_TTL) -> tuple[dict, set, set]:
+    prices, stale = await get_prices(assets, max_age)
+    void = set()
+    for category, asset in assets.items():
+        if is_mocked(category):
+            spread = 0.1 if category == "forex" else 50
+            prices[category] = asset["current_price"] + random.uniform(-spread, spread)
+            stale.discard(category)
+            continue
+        cached = price_cache.get((category, asset["symbol"]))
+        if category not in prices or asset.get("priced_at") is None or cached[1] <= asset["priced_at"]:
+            logger.warning(f"No {asset['symbol']} price newer than the posted one, voiding {category}")
+            prices[category] = asset["current_price"]
+            stale.discard(category)
+            void.add(category)
+        elif category in stale:
+            logger.warning(f"Settling {asset['symbol']} on a stale price")
+    return prices, stale, void
+
+# Outbound Discord traffic: lower number goes first; lifecycle alerts share the onboarding tier
+OUTBOUND_PRIORITY = {"results": 0, "post": 1, "dm": 2, "onboarding": 3}
+OUTBOUND_LIMITS = {  # Route kind -> (calls, per seconds), kept under Discord's per-route limits
+    "channel": (int(os.getenv("OUTBOUND_CHANNEL_RATE", 5)), 5),
+    "reaction": (int(os.getenv("OUTBOUND_REACTION_RATE", 4)), 1),
+    "dm": (int(os.getenv("OUTBOUND_DM_RATE", 5)), 5),
+}
+OUTBOUND_GLOBAL_RATE = int(os.getenv("OUTBOUND_GLOBAL_RATE", 45))  # Calls per second across all routes
+OUTBOUND_WORKERS = int(os.getenv("OUTBOUND_WORKERS", 8))
+OUTBOUND_QUEUE_SIZE = int(os.getenv("OUTBOUND_QUEUE_SIZE", 5000))  # Producers wait once this many calls are pending
+
+# Central send queue: one call in flight per route, each route and the whole bot behind a token bucket,
+# the highest-priority ready route served first, producers held back when the queue is full
+class OutboundQueue:
+    def __init__(self, workers: int = OUTBOUND_WORKERS, capacity: int = OUTBOUND_QUEUE_SIZE):
+        self.workers = workers
+        self.capacity = capacity
+        self.routes = {}  # route -> heap of (priority, seq, call, future)
+        self.ready = []  # heap of (priority, seq, route) for idle routes with pending calls
+        self.busy = set()
+        self.buckets = {}
+        self.global_bucket = TokenBucket(OUTBOUND_GLOBAL_RATE, 1)
+        self.pending = 0
+        self.seq = 0
+        self.changed = asyncio.Condition()
+        self.tasks = []
+
+    def start(self) -> None:
+        if not self.tasks:
+            self.tasks = [bot.loop.create_task(self.worker()) for _ in range(self.workers)]
+
+    def bucket(self, route: str) -> TokenBucket:
+        if route not in self.buckets:
+            self.buckets[route] = TokenBucket(*OUTBOUND_LIMITS[route.split(":", 1)[0]])
+        return self.buckets[route]
+
+    # Queue a call (a zero-argument coroutine function); the future resolves with its result
+    async def enqueue(self, route: str, priority: str, call) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())  # Fire-and-forget callers never read it
+        async with self.changed:
+            await self.changed.wait_for(lambda: self.pending < self.capacity)
+            self.seq += 1
+            entry = (OUTBOUND_PRIORITY[priority], self.seq, call, future)
+            heapq.heappush(self.routes.setdefault(route, []), entry)
+            if route not in self.busy:
+                heapq.heappush(self.ready, (entry[0], entry[1], route))
+            self.pending += 1
+            self.changed.notify_all()
+        return future
+
+    # Queue a call and wait for it to be delivered
+    async def request(self, route: str, priority: str, call):
+        return await (await self.enqueue(route, priority, call))
+
+    # Highest-priority idle route; stale heap entries for busy or drained routes are dropped
+    def next_route(self) -> str | None:
+        while self.ready:
+            _, _, route = heapq.heappop(self.ready)
+            if route not in self.busy and self.routes.get(route):
+                return route
+        return None
+
+    async def worker(self) -> None:
+        while True:
+            async with self.changed:
+                await self.changed.wait_for(lambda: self.ready)
+                route = self.next_route()
+                if route is None:
+                    continue
+                self.busy.add(route)
+                _, _, call, future = heapq.heappop(self.routes[route])
+                self.pending -= 1
+                self.changed.notify_all()
+            try:
+                await self.bucket(route).acquire(float("inf"))
+                await self.global_bucket.acquire(float("inf"))
+                result = await call()
+                if not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                logger.error(f"Outbound call on {route} failed: {e}")
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                async with self.changed:
+                    self.busy.discard(route)
+                    if self.routes[route]:
+                        priority, seq, _, _ = self.routes[route][0]
+                        heapq.heappush(self.ready, (priority, seq, route))
+                        self.changed.notify_all()
+                    else:
+                        del self.routes[route]
+
+outbound = OutboundQueue()
 
 # Web server for keep-alive
 app = Flask('')
@@ -200,34 +1539,42 @@ async def on_ready():
     global last_post_time, config
     logger.info(f"Logged in as {bot.user}")
     global players
-    players = load_players()
+    if players is None:
+        players = PlayerStore(open_player_repository())
+        players.writer_task = bot.loop.create_task(players.writer())
     config = load_config()
     global CHANNEL_ID, ALERT_CHANNEL_ID, SERVER_TIMEZONES
     CHANNEL_ID = config["CHANNEL_ID"]
     ALERT_CHANNEL_ID = config["ALERT_CHANNEL_ID"]
     SERVER_TIMEZONES = config["SERVER_TIMEZONES"]
-    keep_alive()
-    last_post_time = None
-    logger.info("Initial last_post_time reset to None")
-    bot.loop.create_task(game_loop())
+    global game_loop_task
+    if game_loop_task is None:
+        keep_alive()
+        last_post_time = None
+        logger.info("Initial last_post_time reset to None")
+        restore_round()
+        outbound.start()
+        game_loop_task = bot.loop.create_task(game_loop())
+        bot.loop.create_task(sample_ticks())
+        bot.loop.create_task(universe_service.run())
     # Notify if channels unset
     for guild in bot.guilds:
         if guild.id not in CHANNEL_ID or guild.id not in ALERT_CHANNEL_ID:
             default_channel = get_default_channel(guild)
             if default_channel:
-                await default_channel.send("You need to set the channel using !setchannel and !setbotalert.")
+                await outbound.enqueue(f"channel:{default_channel.id}", "onboarding", partial(default_channel.send, "You need to set the channel using !setchannel and !setbotalert."))
     # Restart notification
     for guild in bot.guilds:
         alert_channel = bot.get_channel(ALERT_CHANNEL_ID.get(guild.id))
         if alert_channel:
-            await alert_channel.send("Bot has restarted.")
+            await outbound.enqueue(f"channel:{alert_channel.id}", "onboarding", partial(alert_channel.send, "Bot has restarted."))
 
 # On guild join onboarding
 @bot.event
 async def on_guild_join(guild):
     default_channel = get_default_channel(guild)
     if default_channel:
-        await default_channel.send("Welcome to Market Mover Bot! Setup:\n1. !setchannel in desired post channel.\n2. !setbotalert in alert channel.\n3. !settimezone <tz> (e.g., America/Phoenix).\nUse !help for commands.")
+        await outbound.enqueue(f"channel:{default_channel.id}", "onboarding", partial(default_channel.send, "Welcome to Market Mover Bot! Setup:\n1. !setchannel in desired post channel.\n2. !setbotalert in alert channel.\n3. !settimezone <tz> (e.g., America/Phoenix).\nUse !help for commands."))
 
 # Disconnect event
 @bot.event
@@ -236,7 +1583,7 @@ async def on_disconnect():
     for guild in bot.guilds:
         alert_channel = bot.get_channel(ALERT_CHANNEL_ID.get(guild.id))
         if alert_channel:
-            await alert_channel.send("Bot disconnected, attempting to reconnect.")
+            await outbound.enqueue(f"channel:{alert_channel.id}", "onboarding", partial(alert_channel.send, "Bot disconnected, attempting to reconnect."))
 
 # Resume event
 @bot.event
@@ -245,12 +1592,16 @@ async def on_resume():
     for guild in bot.guilds:
         alert_channel = bot.get_channel(ALERT_CHANNEL_ID.get(guild.id))
         if alert_channel:
-            await alert_channel.send("Bot is back online.")
+            await outbound.enqueue(f"channel:{alert_channel.id}", "onboarding", partial(alert_channel.send, "Bot is back online."))
 
 # Signal handler for shutdown
 def shutdown_handler(signum, frame):
     logger.info("Shutdown signal received")
-    asyncio.run(send_shutdown_alert())
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        sys.exit(0)  # Not connected yet: nothing to alert and no HTTP session open
+    loop.create_task(shutdown())
 signal.signal(signal.SIGTERM, shutdown_handler)
 signal.signal(signal.SIGINT, shutdown_handler)
 
@@ -260,32 +1611,179 @@ async def send_shutdown_alert():
         if alert_channel:
             await alert_channel.send("Bot is shutting down.")
 
+# Runs on the bot's loop, which owns the Discord connection, the player writer and the market data session
+async def shutdown() -> None:
+    if players is not None:
+        await players.shutdown()
+    try:
+        await send_shutdown_alert()
+    except Exception as e:
+        logger.error(f"Error sending shutdown alert: {e}")
+    # After a failed bot.run this is a fresh loop and the old session's loop is already gone
+    try:
+        await market_client.close()
+    except Exception as e:
+        logger.error(f"Error closing market data session: {e}")
+    await bot.close()
+
+# Snapshot the open round; bets placed afterwards go to the round journal
+def save_round() -> None:
+    global round_journal
+    state = {
+        "round_id": current_round_id,
+        "posted_at": last_post_time.timestamp() if last_post_time else None,
+        "assets": current_assets,
+        "messages": [[message_id, *route] for message_id, route in current_messages.items()],
+        "bets": bets,
+    }
+    try:
+        write_snapshot(ROUND_FILE, state)
+        if round_journal is not None:
+            round_journal.close()
+        round_journal = open(ROUND_JOURNAL_FILE, "wb")
+    except Exception as e:
+        logger.error(f"Error saving round: {e}")
+
+# Append one wager so it survives a restart before results
+def journal_bet(user_id: str, category: str) -> None:
+    global round_journal
+    try:
+        if round_journal is None:
+            round_journal = open(ROUND_JOURNAL_FILE, "ab")
+        round_journal.write(encode_journal_record(user_id, {"category": category, **bets[user_id][category]}))
+        round_journal.flush()
+    except Exception as e:
+        logger.error(f"Error journaling bet for {user_id}: {e}")
+
+# Drop persisted round state once it has been settled
+def clear_round() -> None:
+    global round_journal
+    if round_journal is not None:
+        round_journal.close()
+        round_journal = None
+    for path in (ROUND_FILE, f"{ROUND_FILE}.bak", ROUND_JOURNAL_FILE):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+# Rehydrate an open round after a restart without refetching prices or reposting
+def restore_round() -> None:
+    global current_assets, current_messages, bets, current_round_id, last_post_time
+    state = recover_snapshot(ROUND_FILE, None)
+    if not state or not state["assets"]:
+        return
+    current_round_id = state["round_id"]
+    current_assets = state["assets"]
+    last_post_time = datetime.fromtimestamp(state["posted_at"], UTC) if state["posted_at"] else None
+    bets = state["bets"]
+    replayed = 0
+    try:
+        with open(ROUND_JOURNAL_FILE, "rb") as f:
+            for line in f:
+                try:
+                    record = decode_journal_record(line)
+                except ValueError:
+                    break
+                bet = dict(record["data"])
+                bets.setdefault(record["id"], {})[bet.pop("category")] = bet
+                replayed += 1
+    except FileNotFoundError:
+        pass
+    current_messages = {message_id: (guild_id, round_id, category) for message_id, guild_id, round_id, category in state["messages"]}
+    save_round()  # Fold the replayed bets into the snapshot
+    logger.info(f"Restored round {current_round_id}: {sum(len(b) for b in bets.values())} bets ({replayed} from journal)")
+    schedule_settlement()
+
+# Warm the round's prices ahead of the deadline, pin them at the close and settle straight away
+async def run_settlement(results_time: datetime) -> None:
+    global pinned_prices
+    round_id = current_round_id
+    warm_in = (results_time - datetime.now(UTC)).total_seconds() - SETTLEMENT_PREFETCH_SECONDS
+    if warm_in > 0:
+        await asyncio.sleep(warm_in)
+    if current_round_id != round_id or not current_assets:
+        return
+    await get_prices(current_assets)  # Opens connections, probes breakers, fills the cache
+    close_in = (results_time - datetime.now(UTC)).total_seconds()
+    if close_in > 0:
+        await asyncio.sleep(close_in)
+    prices, stale, void = await get_settlement_prices(current_assets, max_age=0)
+    pinned_prices = (round_id, prices, stale, void, datetime.now(UTC))
+    logger.info(f"Pinned settlement prices for round {round_id}: {prices}")
+    await check_results()
+
+# Results deadline of the open round: 14:00 UTC on its own day, or a full round length
+# for rounds forced after that
+def round_deadline() -> datetime | None:
+    if not current_assets or current_round_id is None:
+        return None
+    deadline = datetime.strptime(str(current_round_id), "%Y%m%d").replace(hour=14, tzinfo=UTC)
+    if last_post_time and last_post_time >= deadline:
+        deadline = last_post_time + timedelta(hours=7.5)
+    return deadline
+
+# Start the settlement task for the open round; overdue rounds are left to game_loop
+def schedule_settlement() -> None:
+    global settlement_task
+    if settlement_task is not None and not settlement_task.done():
+        settlement_task.cancel()
+    deadline = round_deadline()
+    if deadline and datetime.now(UTC) < deadline:
+        settlement_task = bot.loop.create_task(run_settlement(deadline))
+
+# Settle the open round if its deadline has passed and the settlement task is not on it
+async def settle_overdue_round() -> None:
+    deadline = round_deadline()
+    if deadline and datetime.now(UTC) >= deadline and (settlement_task is None or settlement_task.done()):
+        logger.info(f"Settling overdue round {current_round_id} (deadline {deadline})")
+        await check_results()
+
 # Game loop
 async def game_loop():
     while True:
+        # Normally run_settlement settles on time; this catches rounds it did not cover,
+        # including ones left open across a restart, a weekend or midnight
+        await settle_overdue_round()
         now = datetime.now(UTC)
         if 0 <= now.weekday() <= 4:
             post_time = now.replace(hour=6, minute=30, second=0, microsecond=0)
-            if now >= post_time and (last_post_time is None or (now - last_post_time) > timedelta(minutes=POST_COOLDOWN_MINUTES)):
-                await post_assets()
-                last_post_time = now
             results_time = now.replace(hour=14, minute=0, second=0, microsecond=0)
-            if now >= results_time and (last_post_time is not None and (now - last_post_time) > timedelta(hours=7)):
-                await check_results()
+            today = int(now.strftime("%Y%m%d"))
+            # Never post over an open round: its bets and deducted points would be lost
+            if post_time <= now < results_time and not current_assets and current_round_id != today and (last_post_time is None or (now - last_post_time) > timedelta(minutes=POST_COOLDOWN_MINUTES)):
+                await post_assets()
         await asyncio.sleep(60)
 
-# Post assets
-async def post_assets():
-    global current_assets, current_messages, bets
-    bets = {}
-    current_assets = get_daily_assets()
-    logger.info(f"Current assets: {current_assets}")
-    for guild in bot.guilds:
+# Members of a guild subscribed to a category: look up each subscriber when they are fewer than
+# the guild's members, otherwise walk the member cache against the index
+def guild_subscribers(guild: discord.Guild, category: str) -> list[discord.Member]:
+    subscriber_ids = players.subscribers(category)
+    if len(subscriber_ids) <= (guild.member_count or 0):
+        members = (guild.get_member(int(user_id)) for user_id in list(subscriber_ids))
+        return [member for member in members if member]
+    return [member for member in guild.members if str(member.id) in subscriber_ids]
+
+# One queued DM per subscriber for a round event, however many categories and guilds it spans;
+# the outbound queue's workers deliver them
+async def send_digests(title: str, lines: dict[str, list[str]]) -> None:
+    queued = 0
+    for user_id, user_lines in lines.items():
+        user = bot.get_user(int(user_id))
+        if user is None:  # No longer shares a guild with the bot
+            continue
+        await outbound.enqueue(f"dm:{user.id}", "dm", partial(user.send, "\n".join([title] + user_lines)))
+        queued += 1
+    logger.info(f"Queued {queued} digest DMs: {title}")
+
+# Post the round's assets to one guild; False when the guild has no usable channel
+async def post_to_guild(guild: discord.Guild, semaphore: asyncio.Semaphore) -> bool:
+    async with semaphore:
         channel_id = CHANNEL_ID.get(guild.id)
         channel = bot.get_channel(channel_id) if channel_id else get_default_channel(guild)
         if not channel or not channel.permissions_for(guild.me).send_messages:
             logger.warning(f"No valid channel in {guild.name}")
-            continue
+            return False
         tz_str = SERVER_TIMEZONES.get(guild.id, 'UTC')
         try:
             tz = timezone(tz_str)
@@ -293,7 +1791,7 @@ async def post_assets():
             tz = UTC
             logger.warning(f"Invalid timezone for {guild.name}, using UTC")
         post_local = datetime.now(tz).strftime("%I:%M %p %Z")
-        results_local = (datetime.now(UTC) + timedelta(hours=7.5)).astimezone(tz).strftime("%I:%M %p %Z")
+        results_local = round_deadline().astimezone(tz).strftime("%I:%M %p %Z")
         for category, asset in current_assets.items():
             role = discord.utils.get(guild.roles, name=category.capitalize())
             mention = role.mention if role else f"@{category.capitalize()}"
@@ -302,36 +1800,73 @@ async def post_assets():
                 description=f"Will {asset['name']} ({asset['symbol']}) go 📈 or 📉 by {results_local}?\nPosted at {post_local}. React to predict free (win 10 points). !bet/!leverage for wagers.",
                 color=0x00ff00
             )
-            msg = await channel.send(embed=embed)
-            await msg.add_reaction("📈")
-            await msg.add_reaction("📉")
-            current_messages[category] = msg
-            # Notify subscribers
-            for user_id, data in players.items():
-                if category in data.get('subscriptions', []):
-                    user = guild.get_member(int(user_id))
-                    if user:
-                        await user.send(f"New {category} prediction in {guild.name}: {asset['name']}")
+            msg = await outbound.request(f"channel:{channel.id}", "post", partial(channel.send, embed=embed))
+            await outbound.request(f"reaction:{channel.id}", "post", partial(msg.add_reaction, "📈"))
+            await outbound.request(f"reaction:{channel.id}", "post", partial(msg.add_reaction, "📉"))
+            current_messages[msg.id] = (guild.id, current_round_id, category)
+            # Notify subscribers; DMs are queued, so a blocked DM cannot stop the guild's post
+            if SUBSCRIBER_DMS == "each":
+                for user in guild_subscribers(guild, category):
+                    await outbound.enqueue(f"dm:{user.id}", "dm", partial(user.send, f"New {category} prediction in {guild.name}: {asset['name']}"))
+        return True
+
+# Post assets; refuses while the previous round is open, since its stakes are already deducted
+async def post_assets() -> bool:
+    global current_assets, current_messages, bets, current_round_id, last_post_time
+    await settle_overdue_round()
+    if current_assets:
+        logger.warning(f"Round {current_round_id} is still open, not posting")
+        return False
+    bets = {}
+    current_messages = {}
+    last_post_time = datetime.now(UTC)
+    current_round_id = int(last_post_time.strftime("%Y%m%d"))
+    tick_store.retain(set())
+    current_assets = await get_daily_assets()
+    logger.info(f"Current assets: {current_assets}")
+    save_round()
+    semaphore = asyncio.Semaphore(POST_CONCURRENCY)
+    started = time.monotonic()
+    results = await asyncio.gather(*(post_to_guild(guild, semaphore) for guild in bot.guilds), return_exceptions=True)
+    failed = [(guild, result) for guild, result in zip(bot.guilds, results) if isinstance(result, Exception)]
+    for guild, e in failed:
+        logger.error(f"Posting to {guild.name} failed: {e}")
+    posted = sum(1 for result in results if result is True)
+    skipped = len(results) - posted - len(failed)
+    logger.info(f"Posted round {current_round_id} to {posted}/{len(results)} guilds ({skipped} skipped, {len(failed)} failed) in {time.monotonic() - started:.1f}s")
+    if SUBSCRIBER_DMS == "digest" and posted:
+        lines = {}
+        for category, asset in current_assets.items():
+            for user_id in list(players.subscribers(category)):
+                lines.setdefault(user_id, []).append(f"{category.capitalize()}: {asset['name']} ({asset['symbol']})")
+        await send_digests("New predictions are open:", lines)
+    save_round()
+    schedule_settlement()
+    return True
 
-# Reaction handler
+# Reaction handler: raw events fire for uncached messages too, routed by message id
 @bot.event
-async def on_reaction_add(reaction: discord.Reaction, user: discord.User):
-    if user.bot or reaction.message not in current_messages.values():
+async def on_raw_reaction_add(payload: discord.RawReactionActionEvent):
+    route = current_messages.get(payload.message_id)
+    if route is None:
         return
-    category = next((cat for cat, msg if msg == reaction.message), None)
-    if not category:
+    _, round_id, category = route
+    if round_id != current_round_id or payload.user_id == bot.user.id:
         return
-    user_id = str(user.id)
-    if user_id not in players:
-        players[user_id] = {"points": 100, "name": user.name, "bet_history": [], "last_daily": 0, "subscriptions": []}
+    member = payload.member or bot.get_user(payload.user_id)
+    if member is None or member.bot:
+        return
+    user_id = str(payload.user_id)
+    players.get_or_create(user_id, member.name)
     if user_id not in bets:
         bets[user_id] = {}
     if category in bets[user_id]:
         return
-    direction = "up" if reaction.emoji == "📈" else "down" if reaction.emoji == "📉" else None
+    direction = "up" if payload.emoji.name == "📈" else "down" if payload.emoji.name == "📉" else None
     if direction:
         bets[user_id][category] = {"points": 0, "direction": direction, "timestamp": time.time()}
-        save_players(players)
+        journal_bet(user_id, category)
+        players.save(user_id)
 
 # Bet command
 @bot.command()
@@ -343,9 +1878,8 @@ async def bet(ctx: commands.Context, points: int, direction: str, category: str)
         await ctx.send("Invalid input. Use: !bet <positive points> <up/down> <crypto/stock/forex>")
         return
     user_id = str(ctx.author.id)
-    if user_id not in players:
-        players[user_id] = {"points": 100, "name": ctx.author.name, "bet_history": [], "last_daily": 0, "subscriptions": []}
-    if players[user_id]["points"] < points:
+    player = players.get_or_create(user_id, ctx.author.name)
+    if player.points < points:
         await ctx.send("Insufficient points.")
         return
     if user_id not in bets:
@@ -354,9 +1888,10 @@ async def bet(ctx: commands.Context, points: int, direction: str, category: str)
         await ctx.send("Already bet on this category.")
         return
     bets[user_id][category] = {"points": points, "direction": direction.lower(), "timestamp": time.time()}
-    players[user_id]["points"] -= points
-    save_players(players)
-    await ctx.send(f"Bet placed: {points} on {direction} for {category}. Balance: {players[user_id]['points']}")
+    journal_bet(user_id, category)  # Before the deduction is flushed, so a crash can only favor the player
+    player.points -= points
+    players.save(user_id)
+    await ctx.send(f"Bet placed: {points} on {direction} for {category}. Balance: {player.points}")
 
 # Other commands similar, with validation
 
@@ -368,26 +1903,34 @@ async def profile(ctx: commands.Context, user: discord.Member = None):
     if user_id not in players:
         await ctx.send("No profile found.")
         return
-    data = players[user_id]
-    wins = sum(1 for bet in data.get('bet_history', []) if bet['correct'])
-    total = len(data['bet_history'])
+    player = players[user_id]
+    wins, total = player.wins, player.total
     win_rate = (wins / total * 100) if total > 0 else 0
     embed = discord.Embed(title=f"{target.name}'s Profile", color=0x00ff00)
-    embed.add_field(name="Points", value=data['points'])
+    embed.add_field(name="Points", value=player.points)
     embed.add_field(name="Win Rate", value=f"{win_rate:.2f}% ({wins}/{total})")
-    embed.add_field(name="Bet History", value="\n".join([f"{b['category']}: {b['direction']} ({'Win' if b['correct'] else 'Loss'})" for b in data['bet_history'][-5:]] or "No history"))
+    embed.add_field(name="Streak", value=f"{player.streak} (best {player.best_streak})")
+    embed.add_field(name="Wins by Category", value="\n".join(f"{cat}: {n}" for cat, n in zip(CATEGORIES, player.category_wins) if n) or "None yet")
+    embed.add_field(name="Bet History", value="\n".join([f"{c}: {d} ({'Win' if ok else 'Loss'})" for c, d, ok in player.bet_history[-5:]] or "No history"))
+    await ctx.send(embed=embed)
+
+# Leaderboard command
+@bot.command()
+async def leaderboard(ctx: commands.Context):
+    top = players.top(5)
+    embed = discord.Embed(title="Leaderboard", color=0x00ff00)
+    embed.description = "\n".join(f"{i}. {player.name}: {player.points} points" for i, (_, player) in enumerate(top, 1)) or "No players yet."
     await ctx.send(embed=embed)
 
 # Daily command
 @bot.command()
 async def daily(ctx: commands.Context):
     user_id = str(ctx.author.id)
-    if user_id not in players:
-        players[user_id] = {"points": 100, "name": ctx.author.name, "bet_history": [], "last_daily": 0, "subscriptions": []}
-    if time.time() - players[user_id]["last_daily"] > 86400:
-        players[user_id]["points"] += 50
-        players[user_id]["last_daily"] = time.time()
-        save_players(players)
+    player = players.get_or_create(user_id, ctx.author.name)
+    if time.time() - player.last_daily > 86400:
+        player.points += 50
+        player.last_daily = time.time()
+        players.save(user_id)
         await ctx.send("Claimed 50 daily points!")
     else:
         await ctx.send("Already claimed today.")
@@ -398,8 +1941,10 @@ async def forcepost(ctx: commands.Context):
     if ctx.author.id != OWNER_ID:
         await ctx.send("Admin only.")
         return
-    await post_assets()
-    await ctx.send("Forced post.")
+    if await post_assets():
+        await ctx.send("Forced post.")
+    else:
+        await ctx.send(f"Round still open until {round_deadline().strftime('%Y-%m-%d %H:%M')} UTC.")
 
 # Resetpoints
 @bot.command()
@@ -409,10 +1954,34 @@ async def resetpoints(ctx: commands.Context, user: discord.Member):
         return
     user_id = str(user.id)
     if user_id in players:
-        players[user_id]["points"] = 100
-        save_players(players)
+        players[user_id].points = 100
+        players.save(user_id)
         await ctx.send(f"Reset {user.name}'s points to 100.")
 
+# Recorded intraday prices for the open round
+@bot.command()
+async def ticks(ctx: commands.Context, category: str):
+    category = category.lower()
+    if category not in current_assets:
+        await ctx.send("No active prediction for that category.")
+        return
+    asset = current_assets[category]
+    recorded = tick_store.ticks((category, asset["symbol"]), last_post_time.timestamp() if last_post_time else 0)
+    lines = [f"{datetime.fromtimestamp(at, UTC).strftime('%H:%M:%S')} UTC: {price}" for at, price in recorded[-10:]]
+    await ctx.send(f"{asset['name']} ({asset['symbol']}) ticks:\n" + ("\n".join(lines) or "None recorded yet."))
+
+# Audit archived bets
+@bot.command()
+async def audit(ctx: commands.Context, user: discord.Member, days: int = 30):
+    if ctx.author.id != OWNER_ID:
+        await ctx.send("Admin only.")
+        return
+    history = await asyncio.get_running_loop().run_in_executor(None, archived_bets, str(user.id), days)
+    wins = sum(1 for bet in history if bet["payout"] > bet["stake"])  # Refunds pay back exactly the stake
+    staked = sum(bet["stake"] for bet in history)
+    paid = sum(bet["payout"] for bet in history)
+    await ctx.send(f"{user.name}, last {days} days: {len(history)} bets, {wins} wins, staked {staked}, paid out {paid}.")
+
 # Subscribe
 @bot.command()
 async def subscribe(ctx: commands.Context, category: str):
@@ -420,14 +1989,21 @@ async def subscribe(ctx: commands.Context, category: str):
     if category not in ["crypto", "stock", "forex"]:
         await ctx.send("Invalid category.")
         return
-    user_id = str(ctx.author.id)
-    if user_id not in players:
-        players[user_id] = {"points": 100, "name": ctx.author.name, "bet_history": [], "last_daily": 0, "subscriptions": []}
-    if category not in players[user_id]["subscriptions"]:
-        players[user_id]["subscriptions"].append(category)
-        save_players(players)
+    if players.subscribe(str(ctx.author.id), ctx.author.name, category):
         await ctx.send(f"Subscribed to {category} notifications.")
 
+# Unsubscribe
+@bot.command()
+async def unsubscribe(ctx: commands.Context, category: str):
+    category = category.lower()
+    if category not in CATEGORIES:
+        await ctx.send("Invalid category.")
+        return
+    if players.unsubscribe(str(ctx.author.id), category):
+        await ctx.send(f"Unsubscribed from {category} notifications.")
+    else:
+        await ctx.send(f"Not subscribed to {category}.")
+
 # Tip
 @bot.command()
 async def tip(ctx: commands.Context, user: discord.Member, points: int):
@@ -436,14 +2012,15 @@ async def tip(ctx: commands.Context, user: discord.Member, points: int):
         return
     sender_id = str(ctx.author.id)
     receiver_id = str(user.id)
-    if sender_id not in players or players[sender_id]["points"] < points:
+    sender = players.get(sender_id)
+    if sender is None or sender.points < points:
         await ctx.send("Insufficient points.")
         return
-    if receiver_id not in players:
-        players[receiver_id] = {"points": 100, "name": user.name, "bet_history": [], "last_daily": 0, "subscriptions": []}
-    players[sender_id]["points"] -= points
-    players[receiver_id]["points"] += points
-    save_players(players)
+    receiver = players.get_or_create(receiver_id, user.name)
+    sender.points -= points
+    receiver.points += points
+    players.save(sender_id)
+    players.save(receiver_id)
     await ctx.send(f"Tipped {points} points to {user.name}.")
 
 # Set timezone
@@ -459,45 +2036,110 @@ async def settimezone(ctx: commands.Context, tz: str):
 
 # Check results
 async def check_results():
+    async with settlement_lock:  # The settlement task and game_loop must not settle the same round twice
+        await settle_round()
+
+# Settlement directions; a flat price or a void category refunds stakes
+VERDICTS = {"up": "went up", "down": "went down", "flat": "was unchanged", "void": "had no price after the post"}
+REFUNDED = ("flat", "void")
+
+def payout_note(direction: str, points: int) -> str:
+    return f"Refunded {points} points." if direction in REFUNDED else f"You won {points} points."
+
+async def settle_round():
     global current_assets, current_messages, bets
     if not current_assets:
         return
-    is_friday = datetime.now(UTC).weekday() == 4
+    is_friday = datetime.strptime(str(current_round_id), "%Y%m%d").weekday() == 4  # The round's day, even if settled late
     multiplier = 2 if is_friday else 1
+    # One price per category for the whole round, shared by every guild
+    if pinned_prices and pinned_prices[0] == current_round_id:
+        _, new_prices, stale, void, pinned_at = pinned_prices
+    else:
+        new_prices, stale, void = await get_settlement_prices(current_assets)
+        pinned_at = datetime.now(UTC)
+    results = {}
+    settled = []
+    for category in CATEGORIES:
+        asset = current_assets[category]
+        if category in void:
+            direction = "void"
+        elif new_prices[category] == asset["current_price"]:
+            direction = "flat"
+        else:
+            direction = "up" if new_prices[category] > asset["current_price"] else "down"
+        outcomes = []
+        for user_id, user_bets in bets.items():
+            if category in user_bets:
+                bet = user_bets[category]
+                # get_or_create: a first-time bettor's record may have been lost in a crash before its flush
+                player = players.get_or_create(user_id, getattr(bot.get_user(int(user_id)), "name", user_id))
+                if direction in REFUNDED:
+                    points_won = bet["points"]  # Stake back, no bonus, not counted in stats
+                else:
+                    correct = bet["direction"] == direction
+                    points_won = (bet["points"] * multiplier if correct else 0) + (10 * multiplier if correct else 0)
+                    player.record_bet(category, bet["direction"], correct)
+                player.points += points_won
+                players.save(user_id)
+                settled.append((user_id, category, bet["direction"], bet["points"], points_won))
+                outcomes.append((user_id, player.name, points_won, player.subscribed(category)))
+        results[category] = (direction, outcomes)
+    # Close the round before the first await: a crash after this point can at worst lose the last
+    # flush window of payouts, like any other write, but never restore the round and pay it twice
+    assets, round_id = current_assets, current_round_id
+    current_assets = {}
+    current_messages = {}
+    bets = {}
+    clear_round()
+    players.flush_soon()
+    round_start = last_post_time.timestamp() if last_post_time else 0
+    intraday = {category: tick_store.summary((category, asset["symbol"]), round_start) for category, asset in assets.items()}
     for guild in bot.guilds:
-        channel = bot.get_channel(CHANNEL_ID.get(guild.id, get_default_channel(guild)))
+        channel_id = CHANNEL_ID.get(guild.id)
+        channel = bot.get_channel(channel_id) if channel_id else get_default_channel(guild)
         if not channel:
             continue
-        for category in ["crypto", "stock", "forex"]:
-            asset = current_assets[category]
-            new_price = fetch_new_price(asset, category)
-            direction = "up" if new_price > asset["current_price"] else "down"
+        for category in CATEGORIES:
+            asset = assets[category]
+            direction, outcomes = results[category]
             embed = discord.Embed(title=f"Results for {category.capitalize()}", color=0x0000ff)
-            embed.description = f"{asset['name']} went {direction}! Old: {asset['current_price']}, New: {new_price}"
+            embed.description = f"{asset['name']} {VERDICTS[direction]}! Old: {asset['current_price']}, New: {new_prices[category]}"
+            if direction in REFUNDED:
+                embed.description += " Stakes refunded."
+            if category in stale:
+                embed.description += " (stale price, provider unavailable)"
+            if intraday[category]:
+                opened, high, low, _ = intraday[category]
+                change = (new_prices[category] - opened) / opened * 100 if opened else 0
+                embed.add_field(name="Intraday", value=f"High {high}, Low {low}, Change {change:+.2f}%", inline=False)
+            embed.set_footer(text=f"Settlement prices as of {pinned_at.strftime('%H:%M:%S')} UTC")
             if is_friday:
                 embed.description += " (Double points!)"
             winners = []
-            for user_id, user_bets in bets.items():
-                if category in user_bets:
-                    bet = user_bets[category]
-                    correct = bet["direction"] == direction
-                    points_won = (bet["points"] * multiplier if correct else 0) + (10 * multiplier if correct else 0)
-                    players[user_id]["points"] += points_won
-                    players[user_id]["bet_history"].append({"category": category, "direction": bet["direction"], "correct": correct})
-                    winners.append(f"{players[user_id]['name']}: +{points_won} points")
-                    # Notify subscriber
-                    if category in players[user_id].get('subscriptions', []):
-                        user = guild.get_member(int(user_id))
-                        if user:
-                            await user.send(f"{category} result in {guild.name}: {direction}. You won {points_won} points.")
+            for user_id, name, points_won, subscribed in outcomes:
+                winners.append(f"{name}: refunded {points_won} points" if direction in REFUNDED else f"{name}: +{points_won} points")
+                # Notify subscriber
+                if subscribed and SUBSCRIBER_DMS == "each":
+                    user = guild.get_member(int(user_id))
+                    if user:
+                        await outbound.enqueue(f"dm:{user.id}", "dm", partial(user.send, f"{category} result in {guild.name}: {VERDICTS[direction]}. {payout_note(direction, points_won)}"))
             if winners:
-                embed.add_field(name="Winners", value="\n".join(winners))
+                embed.add_field(name="Refunds" if direction in REFUNDED else "Winners", value="\n".join(winners))
             else:
                 embed.add_field(name="Winners", value="No bets.")
-            await channel.send(embed=embed)
-    current_assets = {}
-    current_messages = {}
-    bets = {}
+            await outbound.enqueue(f"channel:{channel.id}", "results", partial(channel.send, embed=embed))
+    # Digests after the embeds, so a DM backlog cannot hold results back
+    if SUBSCRIBER_DMS == "digest":
+        lines = {}
+        for category in CATEGORIES:
+            direction, outcomes = results[category]
+            for user_id, _, points_won, subscribed in outcomes:
+                if subscribed:
+                    lines.setdefault(user_id, []).append(f"{category.capitalize()}: {assets[category]['name']} {VERDICTS[direction]}. {payout_note(direction, points_won)}")
+        await send_digests("Round results:", lines)
+    if settled:
+        await asyncio.get_running_loop().run_in_executor(player_executor, archive_bets, round_id, settled)
 
 # Custom help
 @bot.command()
@@ -510,7 +2152,9 @@ async def help(ctx: commands.Context):
     embed.add_field(name="!daily", value="Claim 50 daily points.", inline=False)
     embed.add_field(name="!tip <user> <points>", value="Transfer points to user.", inline=False)
     embed.add_field(name="!subscribe <category>", value="Get DM notifications for category.", inline=False)
+    embed.add_field(name="!unsubscribe <category>", value="Stop DM notifications for category.", inline=False)
     embed.add_field(name="!leaderboard", value="Top 5 players.", inline=False)
+    embed.add_field(name="!ticks <category>", value="Recorded prices for today's asset.", inline=False)
     embed.add_field(name="!support", value="Donation info.", inline=False)
     embed.add_field(name="!setchannel", value="Set post channel.", inline=False)
     embed.add_field(name="!setbotalert", value="Set alert channel.", inline=False)
@@ -518,13 +2162,24 @@ async def help(ctx: commands.Context):
     if ctx.author.id == OWNER_ID:
         embed.add_field(name="!forcepost", value="Admin: Force daily post.", inline=False)
         embed.add_field(name="!resetpoints <user>", value="Admin: Reset user points to 100.", inline=False)
+        embed.add_field(name="!audit <user> [days]", value="Admin: Archived bet history.", inline=False)
     await ctx.send(embed=embed)
 
 # Leverage command (similar to bet, with validation)
 
+# Rewrite the players snapshot in the configured format (python bot.py --convert-players)
+def convert_players() -> None:
+    repo = JsonPlayerRepository()  # Replays any journal tail first
+    repo.compact()
+    logger.info(f"Converted {repo.count()} players to {SNAPSHOT_FORMAT}/{SNAPSHOT_COMPRESSION}")
+
+if "--convert-players" in sys.argv:
+    convert_players()
+    sys.exit(0)
+
 # Run bot
 try:
     bot.run(BOT_TOKEN)
 except Exception as e:
     logger.error(f"Bot error: {e}")
-    asyncio.run(shutdown_task())
\ No newline at end of file
+    asyncio.run(shutdown())
\ No newline at end of file